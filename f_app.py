@@ -1,73 +1,535 @@
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 from typing import Optional
 import json
-from openai import OpenAI
-import chromadb
+import hashlib
+import asyncio
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, BadRequestError, InternalServerError, RateLimitError
 from dotenv import load_dotenv
 import os
 import re
+import threading
+import numpy as np
+import httpx
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 from contextlib import asynccontextmanager
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process build lock (single-process dev runs)
+    fcntl = None
+from cachetools import TTLCache
 
 load_dotenv()
 
 # Global variables
 client = None
-collection = None
-data = None
+index_embs = None
+index_scales = None
+index_rows = None
+index_items = None
+index_strings = None
+index_string_offsets = None
+finance_prototypes = None
+embedding_queue = None
+batcher_task = None
 
-def get_embedding(text: str):
-    """Helper function to get embeddings - defined before lifespan"""
-    response = client.embeddings.create(
+# Max texts per embeddings request (API limit is 2048)
+EMBEDDING_BATCH_SIZE = 512
+# text-embedding-3-small is truncated to this many dimensions
+EMBEDDING_DIM = 512
+
+# Persisted vector index (int8-quantized embeddings + metadata), keyed by a
+# hash of the dataset so edits to json_data.json invalidate it automatically
+DATA_PATH = "json_data.json"
+INDEX_DIR = "index_cache"
+# Bump when the stored layout changes so old caches are rebuilt
+INDEX_FORMAT_VERSION = 5
+# Index metadata is stored as fixed-width records pointing into one UTF-8
+# string table, so it can be memory-mapped and shared like the embeddings.
+# Rows are the indexed questions; answers are stored once per FAQ item
+LANGUAGES = ("english", "hinglish", "hindi")
+ROW_DTYPE = np.dtype([("item", np.int32), ("language", np.int8), ("question", np.int32)])
+ITEM_DTYPE = np.dtype([("id", np.int32), ("answers", np.int32, (len(LANGUAGES),)), ("is_finance", np.bool_)])
+INDEX_CACHE_PARTS = ("embs", "scales", "items", "strings", "offsets", "rows")
+# Rows scored per block; the float32 upcast of a block stays cache-resident,
+# so int8 search runs close to a plain float32 SGEMV
+SEARCH_BLOCK_SIZE = 512
+# Concurrent embedding requests during ingestion
+EMBEDDING_CONCURRENCY = 20
+# Query embeddings from concurrent requests are sent together: up to this many
+# texts, waiting at most this long for the batch to fill
+QUERY_BATCH_MAX_SIZE = 64
+QUERY_BATCH_MAX_WAIT_SECONDS = 0.01
+# Longest accepted question; keeps single inputs well under the embedding token limit
+MAX_QUESTION_CHARS = 2000
+
+# Shared OpenAI connection pool (HTTP/2 + keep-alive). The read timeout leaves
+# room for non-streamed GPT answers; connects fail fast
+OPENAI_MAX_CONNECTIONS = 200
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 100
+OPENAI_TIMEOUT_SECONDS = 30.0
+OPENAI_CONNECT_TIMEOUT_SECONDS = 2.0
+
+# Retries for OpenAI calls (the SDK's own retries are disabled): rate limits
+# plus the transient errors the SDK used to retry
+OPENAI_RETRY_ATTEMPTS = 4
+OPENAI_RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+OPENAI_RETRY_MIN_SECONDS = 1
+OPENAI_RETRY_MAX_SECONDS = 20
+RATE_LIMIT_RESET_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+RATE_LIMIT_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+# Query caches (keyed by normalized query text)
+CACHE_MAXSIZE = 2000
+CACHE_TTL_SECONDS = 3600
+embedding_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL_SECONDS)
+answer_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL_SECONDS)
+cache_lock = threading.Lock()
+cache_stats = {"embedding_hits": 0, "embedding_misses": 0, "answer_hits": 0, "answer_misses": 0}
+
+# Prototype phrases for the embedding-based finance classifier. Every language
+# (English, Hinglish, Hindi) has both classes, since embeddings lean towards
+# text in the same script
+FINANCE_PROTOTYPES = [
+    # English
+    "stock market investment",
+    "mutual fund SIP",
+    "banking and bank account",
+    "trading shares and equity",
+    "insurance, loans and interest rates",
+    # Hinglish
+    "share market mein invest kaise kare",
+    "mutual fund aur SIP kya hai",
+    "bank account aur loan ka interest",
+    # Hindi
+    "शेयर बाजार और म्यूचुअल फंड में निवेश",
+    "बैंक खाता, लोन और ब्याज दर",
+    "बीमा और टैक्स की बचत",
+]
+NON_FINANCE_PROTOTYPES = [
+    # English
+    "weather forecast today",
+    "movie, music and entertainment",
+    "cooking recipe and food",
+    "sports match score",
+    "health, medicine and fitness",
+    "travel and tourism",
+    # Hinglish
+    "aaj mausam kaisa hai",
+    "khana banane ki recipe batao",
+    "cricket match ka score kya hai",
+    "nayi movie aur gaane",
+    # Hindi
+    "आज मौसम कैसा रहेगा",
+    "खाना बनाने की विधि",
+    "क्रिकेट मैच का स्कोर",
+    "स्वास्थ्य, दवा और व्यायाम",
+    "घूमने की जगह और यात्रा",
+]
+FINANCE_MARGIN = 0.02
+# Queries whose top match is a finance FAQ entry within this distance are
+# treated as finance without running the classifier
+NEAR_FINANCE_DISTANCE = 0.5
+
+# Near-miss matches within this factor of the strict distance cutoff still
+# return the stored answer, with their similarity scaled down by the penalty
+WARM_DISTANCE_FACTOR = 1.15
+WARM_CONFIDENCE_PENALTY = 0.9
+
+# Folio number guard: 8+ digit numbers alongside a folio keyword
+FOLIO_NUMBER_RE = re.compile(r'\d{8,}')
+FOLIO_KEYWORDS = ("folio", "फोलियो")
+
+# GPT fallback context: only the best match is sent unless the runner-up is this close
+CONTEXT_TIE_MARGIN = 0.05
+# Rows indexed per FAQ item (one per question language)
+MAX_ROWS_PER_ITEM = 3
+DEVANAGARI_RE = re.compile(r'[\u0900-\u097F]')
+
+def make_openai_client() -> AsyncOpenAI:
+    """Create an OpenAI client on a tuned, pooled HTTP/2 connection; retries are left to openai_retry"""
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS
+        ),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS)
+    )
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client, max_retries=0)
+
+def parse_rate_limit_reset(value: str) -> Optional[float]:
+    """Parse an x-ratelimit-reset-* header such as "20ms", "1s" or "6m0s" into seconds"""
+    parts = RATE_LIMIT_RESET_RE.findall(value or "")
+    if not parts:
+        return None
+    return sum(float(amount) * RATE_LIMIT_UNIT_SECONDS[unit] for amount, unit in parts)
+
+_exponential_wait = wait_random_exponential(min=OPENAI_RETRY_MIN_SECONDS, max=OPENAI_RETRY_MAX_SECONDS)
+
+def wait_for_retry(retry_state) -> float:
+    """
+    Back off exponentially; on a 429, wait longer if OpenAI reports a later reset.
+    Both request and token limits report a reset; the exhausted one (remaining 0)
+    is the one that caused the 429, otherwise the later reset is used.
+    """
+    delay = _exponential_wait(retry_state)
+    error = retry_state.outcome.exception()
+    if isinstance(error, RateLimitError):
+        response = error.response
+        resets, exhausted = [], []
+        for kind in ("requests", "tokens"):
+            reset = parse_rate_limit_reset(response.headers.get(f"x-ratelimit-reset-{kind}"))
+            if reset is not None:
+                resets.append(reset)
+                if response.headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+                    exhausted.append(reset)
+        if exhausted or resets:
+            delay = max(delay, max(exhausted or resets))
+    delay = min(delay, OPENAI_RETRY_MAX_SECONDS)
+    print(f"⚠️ {type(error).__name__}, retrying in {delay:.1f}s...")
+    return delay
+
+openai_retry = retry(
+    wait=wait_for_retry,
+    stop=stop_after_attempt(OPENAI_RETRY_ATTEMPTS),
+    retry=retry_if_exception_type(OPENAI_RETRYABLE_ERRORS),
+    reraise=True
+)
+
+def normalize_query(text: str) -> str:
+    """Normalize a query for use as a cache key"""
+    return text.strip().lower()
+
+async def get_embedding(text: str):
+    """Helper function to get embeddings - queued for the micro-batcher started in the lifespan"""
+    if len(text) > MAX_QUESTION_CHARS:
+        raise ValueError(f"Question is longer than {MAX_QUESTION_CHARS} characters")
+    fut = asyncio.get_running_loop().create_future()
+    await embedding_queue.put((text, fut))
+    return await fut
+
+def fail_batch(batch: list, error: Exception):
+    """Resolve every pending future in a batch with the error"""
+    for _, fut in batch:
+        if not fut.done():
+            fut.set_exception(error)
+
+async def try_embed_batch(batch: list) -> Optional[BadRequestError]:
+    """Embed a batch and resolve its futures; a 400 is returned unresolved, any other error fails the batch"""
+    try:
+        embs = await embed_chunk(client, [text for text, _ in batch])
+    except BadRequestError as e:
+        return e
+    except Exception as e:
+        fail_batch(batch, e)
+        return None
+    for (_, fut), emb in zip(batch, embs):
+        if not fut.done():
+            fut.set_result(emb)
+    return None
+
+async def embed_query_batch(batch: list):
+    """
+    Embed a batch of queued (text, future) pairs and resolve each future.
+    Auth, 404, rate-limit and server errors hit every input alike, so they fail the
+    batch at once. A 400 may come from a single bad input, so the batch is bisected,
+    following only the failing half (about 2 calls per halving). If both halves fail,
+    the error is not down to one input and every remaining input fails.
+    """
+    error = await try_embed_batch(batch)
+    while error is not None and len(batch) > 1:
+        mid = len(batch) // 2
+        halves = (batch[:mid], batch[mid:])
+        errors = await asyncio.gather(*(try_embed_batch(half) for half in halves))
+        failed = [(half, err) for half, err in zip(halves, errors) if err is not None]
+        if len(failed) != 1:
+            for half, err in failed:
+                fail_batch(half, err)
+            return
+        batch, error = failed[0]
+    if error is not None:
+        fail_batch(batch, error)
+
+async def embedding_batcher():
+    """Collect queued query embeddings into batches and send each as one API call"""
+    loop = asyncio.get_running_loop()
+    in_flight = set()
+    while True:
+        batch = [await embedding_queue.get()]
+        deadline = loop.time() + QUERY_BATCH_MAX_WAIT_SECONDS
+        while len(batch) < QUERY_BATCH_MAX_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(embedding_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Send without waiting so the next batch can fill during the API call
+        task = asyncio.create_task(embed_query_batch(batch))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+async def get_embedding_cached(text: str):
+    """Return the unit-normalized embedding for a query, reusing cached embeddings for repeats"""
+    key = normalize_query(text)
+    with cache_lock:
+        emb = embedding_cache.get(key)
+        if emb is not None:
+            cache_stats["embedding_hits"] += 1
+            return emb
+        cache_stats["embedding_misses"] += 1
+
+    emb = to_unit_matrix([await get_embedding(text)])[0]
+    with cache_lock:
+        embedding_cache[key] = emb
+    return emb
+
+@openai_retry
+async def embed_chunk(async_client: AsyncOpenAI, texts: list):
+    """Embed one batch asynchronously, retrying rate limits and transient errors"""
+    response = await async_client.embeddings.create(
         model="text-embedding-3-small",
-        input=text
+        input=texts,
+        dimensions=EMBEDDING_DIM
     )
-    return response.data[0].embedding
+    return [d.embedding for d in response.data]
+
+@openai_retry
+async def create_chat_completion(prompt: str, stream: bool = False):
+    """Run the GPT fallback completion, retrying rate limits and transient errors"""
+    return await client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[{"role": "user", "content": prompt}],
+        stream=stream
+    )
+
+async def embed_all(async_client: AsyncOpenAI, texts: list):
+    """Embed texts in concurrent batches, returning embeddings in input order"""
+    sem = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+    async def bounded(chunk):
+        async with sem:
+            return await embed_chunk(async_client, chunk)
+
+    chunks = [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+    results = await asyncio.gather(*[bounded(c) for c in chunks])
+    return [emb for chunk_embs in results for emb in chunk_embs]
+
+def to_unit_matrix(embs) -> np.ndarray:
+    """Stack embeddings into a float32 matrix with unit-length rows"""
+    mat = np.asarray(embs, dtype=np.float32)
+    return mat / np.linalg.norm(mat, axis=1, keepdims=True)
+
+def index_cache_paths(data_hash: str) -> dict:
+    """Return the cache file path of each index part for a dataset hash"""
+    base = os.path.join(INDEX_DIR, f"embeddings_{data_hash}")
+    return {part: f"{base}.{part}.npy" for part in INDEX_CACHE_PARTS}
+
+def get_string(i: int) -> str:
+    """Read entry i of the memory-mapped string table"""
+    return bytes(index_strings[index_string_offsets[i]:index_string_offsets[i + 1]]).decode("utf-8")
+
+def row_question(label: int) -> str:
+    """Return the indexed question text of a row"""
+    return get_string(index_rows[label]["question"])
+
+def row_meta(label: int) -> dict:
+    """Return a row's metadata (language, answers of its FAQ item, finance flag)"""
+    row = index_rows[label]
+    item = index_items[row["item"]]
+    lang = LANGUAGES[row["language"]]
+    meta = {
+        "id": f"{get_string(item['id'])}_{lang}",
+        "language": lang,
+        "is_finance": bool(item["is_finance"])
+    }
+    for i, answer_lang in enumerate(LANGUAGES):
+        meta[f"answer_{answer_lang}"] = get_string(item["answers"][i])
+    return meta
+
+def detect_query_language(user_query: str, top_meta: dict) -> str:
+    """Guess the query language: Devanagari is Hindi, Latin script follows the top match (English or Hinglish)"""
+    if DEVANAGARI_RE.search(user_query):
+        return "hindi"
+    return top_meta["language"] if top_meta["language"] in ("english", "hinglish") else "english"
+
+def quantize_int8(mat: np.ndarray):
+    """Scalar-quantize each row to int8, returning (codes, per-row dequant scale)"""
+    mat = np.atleast_2d(np.asarray(mat, dtype=np.float32))
+    scales = np.abs(mat).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.round(mat / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+def search_index(query_emb: np.ndarray, k: int = 2):
+    """Brute-force inner-product search over the int8 index for a unit query, returning (labels, cosine distances)"""
+    # Only the corpus is quantized; the query stays float32, since each block is upcast anyway
+    q = np.asarray(query_emb, dtype=np.float32)
+
+    dots = np.empty(len(index_embs), dtype=np.float32)
+    for start in range(0, len(index_embs), SEARCH_BLOCK_SIZE):
+        block = index_embs[start:start + SEARCH_BLOCK_SIZE].astype(np.float32)
+        dots[start:start + len(block)] = block @ q
+    # Quantization error can push scores slightly past +/-1
+    scores = np.clip(dots * index_scales, -1.0, 1.0)
+
+    # Partial selection of the top k, then sort only those k
+    k = min(k, len(scores))
+    labels = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    labels = labels[np.argsort(-scores[labels])]
+    return labels, 1 - scores[labels]
+
+def top_distinct_items(labels, distances, n: int = 2):
+    """Keep the best-scoring row of each FAQ item, up to n items"""
+    seen, keep = set(), []
+    for i, label in enumerate(labels):
+        key = int(index_rows[label]["item"])
+        if key not in seen:
+            seen.add(key)
+            keep.append(i)
+            if len(keep) == n:
+                break
+    return labels[keep], distances[keep]
+
+def is_finance_query(query_emb: np.ndarray) -> bool:
+    """Classify a unit query embedding as finance-related by its nearest prototype phrase"""
+    scores = finance_prototypes @ query_emb
+    n_finance = len(FINANCE_PROTOTYPES)
+    finance_score = scores[:n_finance].max()
+    other_score = scores[n_finance:].max()
+    print(f"🔍 Finance score: {finance_score:.4f} vs non-finance: {other_score:.4f}")
+    return finance_score > other_score + FINANCE_MARGIN
+def save_atomic(path: str, write):
+    """Write a cache file via a temp file so readers never see a partial file"""
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+@asynccontextmanager
+async def cache_build_lock():
+    """Hold an exclusive lock on INDEX_DIR so only one worker builds cache files at a time"""
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    with open(os.path.join(INDEX_DIR, ".build.lock"), "w") as lock_file:
+        if fcntl is not None:
+            # Wait in a thread so the event loop is not blocked while another worker builds
+            await asyncio.to_thread(fcntl.flock, lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+async def build_index(openai_client: AsyncOpenAI, paths: dict, raw_data: bytes):
+    """Embed the dataset (the json_data.json bytes the cache key was hashed from) and save the index to the cache paths"""
+    # The parsed dataset is only needed while building the index
+    local_data = json.loads(raw_data.decode("utf-8"))
+
+    strings, all_docs, rows, items = [], [], [], []
+
+    def add_string(text: str) -> int:
+        strings.append(text.encode("utf-8"))
+        return len(strings) - 1
+
+    for item in local_data:
+        items.append((
+            add_string(str(item["id"])),
+            [add_string(item["answer"][lang]) for lang in LANGUAGES],
+            item.get("is_finance", True)
+        ))
+        for lang_idx, lang in enumerate(LANGUAGES):
+            q_text = item["question"][lang]
+            if q_text.strip():
+                all_docs.append(q_text)
+                rows.append((len(items) - 1, lang_idx, add_string(q_text)))
+    del local_data
+
+    # Embed in concurrent batches instead of one HTTP call per question
+    all_embs = await embed_all(openai_client, all_docs)
+
+    # Normalize once so cosine similarity is a plain dot product at query time
+    embs = to_unit_matrix(np.asarray(all_embs, dtype=np.float32).reshape(-1, EMBEDDING_DIM))
+    codes, scales = quantize_int8(embs)
+
+    arrays = {
+        "embs": codes,
+        "scales": scales,
+        "items": np.array(items, dtype=ITEM_DTYPE),
+        "strings": np.frombuffer(b"".join(strings), dtype=np.uint8),
+        "offsets": np.concatenate([[0], np.cumsum([len(b) for b in strings])]).astype(np.int64),
+        "rows": np.array(rows, dtype=ROW_DTYPE)
+    }
+    # Rows are written last: their presence marks the cache as complete
+    for part in INDEX_CACHE_PARTS:
+        save_atomic(paths[part], lambda f: np.save(f, arrays[part]))
+    print("✅ Vector index built and saved!")
+
+async def load_or_build_index(openai_client: AsyncOpenAI):
+    """
+    Load the cached index for the current dataset, building it first if missing.
+    Every part, metadata included, is memory-mapped, so workers share one copy through the page cache.
+    """
+    with open(DATA_PATH, "rb") as f:
+        raw_data = f.read()
+    hasher = hashlib.sha256(raw_data)
+    hasher.update(f"dim={EMBEDDING_DIM};format={INDEX_FORMAT_VERSION}".encode())
+    paths = index_cache_paths(hasher.hexdigest())
+
+    if not os.path.exists(paths["rows"]):
+        async with cache_build_lock():
+            # Another worker may have finished the build while we waited
+            if not os.path.exists(paths["rows"]):
+                await build_index(openai_client, paths, raw_data)
+    del raw_data
+
+    parts = {part: np.load(paths[part], mmap_mode="r") for part in INDEX_CACHE_PARTS}
+    print("✅ Vector index loaded from disk!")
+    return parts
+
+async def load_or_build_prototypes(openai_client: AsyncOpenAI) -> np.ndarray:
+    """Load the cached finance classifier prototypes, embedding them first if missing"""
+    key = hashlib.sha256(
+        json.dumps([FINANCE_PROTOTYPES, NON_FINANCE_PROTOTYPES, EMBEDDING_DIM], ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    path = os.path.join(INDEX_DIR, f"prototypes_{key}.npy")
+
+    if not os.path.exists(path):
+        async with cache_build_lock():
+            if not os.path.exists(path):
+                prototypes = to_unit_matrix(await embed_all(openai_client, FINANCE_PROTOTYPES + NON_FINANCE_PROTOTYPES))
+                save_atomic(path, lambda f: np.save(f, prototypes))
+    return np.load(path)
+
 # --------- Lifespan context manager ---------
 @asynccontextmanager
 async def initialize_app(app: FastAPI):
     # Startup: Initialize resources
-    global client, collection, data
+    global client, index_embs, index_scales, index_rows, index_items, index_strings, index_string_offsets, finance_prototypes, embedding_queue, batcher_task
     
     # Initialize OpenAI client
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    
-    # Load JSON data
-    with open("json_data.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
-    
-    # Setup Chroma with persistence
-    chroma_client = chromadb.PersistentClient(path="./chroma_db")
-    collection = chroma_client.get_or_create_collection(name="qna_collection", metadata={"hnsw:space":"cosine"})
+    client = make_openai_client()
+
+    # Start the query embedding micro-batcher
+    embedding_queue = asyncio.Queue()
+    batcher_task = asyncio.create_task(embedding_batcher())
     
-    # Store data if not already present
-    if collection.count() == 0:
-        for item in data:
-            q_eng = item["question"]["english"]
-            q_hing = item["question"]["hinglish"]
-            q_hin = item["question"]["hindi"]
-
-            for lang, q_text in [("english", q_eng), ("hinglish", q_hing), ("hindi", q_hin)]:
-                if q_text.strip():
-                    emb = get_embedding(q_text)
-                    collection.add(
-                        ids=[f"{item['id']}_{lang}"],
-                        documents=[q_text],
-                        metadatas=[{
-                            "answer_english": item["answer"]["english"],
-                            "answer_hinglish": item["answer"]["hinglish"],
-                            "answer_hindi": item["answer"]["hindi"],
-                            "language": lang
-                        }],
-                        embeddings=[emb]
-                    )
-        print("✅ Data stored in persistent ChromaDB!")
-    else:
-        print("✅ ChromaDB already populated!")
+    # Load the persisted index (built by prepare_cache when run as a launcher)
+    parts = await load_or_build_index(client)
+    index_embs, index_scales, index_rows = parts["embs"], parts["scales"], parts["rows"]
+    index_items, index_strings, index_string_offsets = parts["items"], parts["strings"], parts["offsets"]
+
+    # Finance classifier prototypes are embedded once and cached with the index
+    finance_prototypes = await load_or_build_prototypes(client)
     
     yield
     
-    # Shutdown: Cleanup (if needed)
+    # Shutdown: Cleanup
+    batcher_task.cancel()
+    await client.close()
     print("🔴 Shutting down...")
 
 # Initialize FastAPI app
@@ -79,7 +541,7 @@ app = FastAPI(
 
 # --------- Pydantic Models ---------
 class QueryRequest(BaseModel):
-    question: str
+    question: str = Field(max_length=MAX_QUESTION_CHARS)
     similarity_threshold: Optional[float] = 0.7
 
 class QueryResponse(BaseModel):
@@ -90,83 +552,112 @@ class QueryResponse(BaseModel):
 
 class HealthResponse(BaseModel):
     status: str
-    question: str
+    message: str
     database_count: int
 
 #main_function
-def rag_answer(user_query: str, similarity_threshold: float = 0.7):
+async def rag_answer(user_query: str, similarity_threshold: float = 0.7):
+    answer, similarity, prompt = await prepare_answer(user_query, similarity_threshold)
+    if prompt is None:
+        return answer, similarity
+
+    response = await create_chat_completion(prompt)
+
+    answer = response.choices[0].message.content
+    cache_answer(user_query, similarity_threshold, answer, similarity)
+    return answer, similarity
+
+def cache_answer(user_query: str, similarity_threshold: float, answer: str, similarity: float):
+    """Store a final answer for repeats of the same query"""
+    with cache_lock:
+        answer_cache[(normalize_query(user_query), similarity_threshold)] = (answer, similarity)
+
+async def prepare_answer(user_query: str, similarity_threshold: float):
+    """
+    Resolve a query up to the GPT fallback.
+    Returns (answer, similarity, prompt); prompt is set only when a GPT answer must be generated.
+    """
     # Folio number check
-    folio_keywords = ["folio", "folio number", "फोलियो", "फोलियो नंबर"]
-    numbers = re.findall(r'\d+', user_query)
-    for num in numbers:
-        if len(num) > 7 and any(keyword.lower() in user_query.lower() for keyword in folio_keywords):
-            return "Sorry, I can't provide information about folio numbers.", 0.0
+    q_lower = user_query.lower()
+    if FOLIO_NUMBER_RE.search(user_query) and any(keyword in q_lower for keyword in FOLIO_KEYWORDS):
+        return "Sorry, I can't provide information about folio numbers.", 0.0, None
 
-    # Embed user query
-    query_emb = get_embedding(user_query)
+    # Serve repeated queries straight from the answer cache
+    cache_key = (normalize_query(user_query), similarity_threshold)
+    with cache_lock:
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            cache_stats["answer_hits"] += 1
+        else:
+            cache_stats["answer_misses"] += 1
+    if cached is not None:
+        print(f"⚡ Answer cache hit ({cache_stats['answer_hits']} hits / {cache_stats['answer_misses']} misses)")
+        return cached[0], cached[1], None
 
-    # Retrieve top 2 relevant results
-    results = collection.query(
-        query_embeddings=[query_emb],
-        n_results=2,
-        include=["documents", "metadatas", "distances"]
-    )
+    answer, similarity, prompt = await _prepare_answer_uncached(user_query, similarity_threshold)
+    if prompt is None:
+        cache_answer(user_query, similarity_threshold, answer, similarity)
+    return answer, similarity, prompt
 
+async def _prepare_answer_uncached(user_query: str, similarity_threshold: float):
     # Handle no results
-    if not results["documents"][0]:
-        return "No similar question found in the dataset.", 0.0
+    if index_rows is None or not len(index_rows):
+        return "No similar question found in the dataset.", 0.0, None
+
+    # Embed user query
+    query_emb = await get_embedding_cached(user_query)
 
-    top_distance = results["distances"][0][0]
-    meta = results["metadatas"][0][0]
-    top_doc = results["documents"][0][0]
+    # Retrieve the top 2 distinct FAQ items. Each item is indexed once per
+    # language, so 4 rows always cover at least 2 items when the corpus has them
+    labels, distances = search_index(query_emb, k=MAX_ROWS_PER_ITEM + 1)
+    labels, distances = top_distinct_items(labels, distances, n=2)
+
+    top_distance = float(distances[0])
+    meta = row_meta(labels[0])
+    top_doc = row_question(labels[0])
 
     print(f"🔍 Top matched question: {top_doc}")
     print(f"🔍 Distance: {top_distance}")
     print(f"🔍 Similarity threshold: {similarity_threshold}")
-    print(f"🔍 Checking if {top_distance} <= {1 - similarity_threshold}")
+    strict_distance = 1 - similarity_threshold
+    warm_distance = strict_distance * WARM_DISTANCE_FACTOR
+    print(f"🔍 Checking if {top_distance} <= {strict_distance} (warm: {warm_distance})")
 
     # ✅ EXACT SAME LOGIC AS WORKING CODE
-    if top_distance <= (1 - similarity_threshold):
-        lang = meta["language"]
+    lang = meta["language"]
+    if top_distance <= strict_distance:
         print(f"✅ Match found! Returning {lang} answer")
-        if lang == "english":
-            return meta["answer_english"], 1 - top_distance
-        elif lang == "hindi":
-            return meta["answer_hindi"], 1 - top_distance
-        elif lang == "hinglish":
-            return meta["answer_hinglish"], 1 - top_distance
+        return meta[f"answer_{lang}"], 1 - top_distance, None
+
+    # Near miss: the stored answer is still close enough to skip GPT
+    if top_distance <= warm_distance:
+        print(f"✅ Warm match found! Returning {lang} answer")
+        return meta[f"answer_{lang}"], (1 - top_distance) * WARM_CONFIDENCE_PENALTY, None
 
     # GPT fallback with finance filter
     print("⚠️ No exact match, checking if question is finance-related...")
     
-    # First, check if the question is about finance/stock market
-    finance_check_prompt = f"""
-You are a financial domain classifier. Determine if the following question is related to finance, stock market, investments, mutual funds, trading, banking, or financial services.
-
-Question: {user_query}
-
-Answer with ONLY "YES" if it's finance-related, or "NO" if it's not finance-related. No explanation needed.
-"""
-
-    finance_check = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": finance_check_prompt}],
-        temperature=0
+    # First, check if the question is about finance/stock market; a close
+    # match from the finance FAQ already answers that
+    near_finance = top_distance <= NEAR_FINANCE_DISTANCE and any(
+        index_items[index_rows[label]["item"]]["is_finance"] for label in labels
     )
-    
-    is_finance_related = finance_check.choices[0].message.content.strip().upper()
-    print(f"🔍 Finance check result: {is_finance_related}")
-    
-    if is_finance_related != "YES":
-        return "I'm sorry, I can only answer questions related to finance, stock market, and investments. Please ask a finance-related question.", 0.0
+    if not near_finance and not is_finance_query(query_emb):
+        return "I'm sorry, I can only answer questions related to finance, stock market, and investments. Please ask a finance-related question.", 0.0, None
     
     # If finance-related, proceed with GPT answer using context
     print("✅ Finance-related question, generating answer...")
+    query_lang = detect_query_language(user_query, meta)
+    # labels already hold distinct items, so the runner-up is never a repeat of the top answer
+    context_labels = labels[:1]
+    if len(labels) > 1 and abs(distances[0] - distances[1]) < CONTEXT_TIE_MARGIN:
+        context_labels = labels[:2]
     contexts = []
-    for i in range(len(results["documents"][0])):
-        doc = results["documents"][0][i]
-        meta = results["metadatas"][0][i]
-        contexts.append(f"Q: {doc}\nA (English): {meta['answer_english']}\nA (Hindi): {meta['answer_hindi']}")
+    for label in context_labels:
+        doc = row_question(label)
+        ctx_meta = row_meta(label)
+        answer = ctx_meta[f"answer_{query_lang}"] or ctx_meta["answer_english"]
+        contexts.append(f"Q: {doc}\nA: {answer}")
 
     context_text = "\n\n".join(contexts)
     prompt = f"""
@@ -180,12 +671,7 @@ User Query: {user_query}
 Answer in a clear and natural way. Focus only on financial information.
 """
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}]
-    )
-
-    return response.choices[0].message.content, 1 - top_distance
+    return None, 1 - top_distance, prompt
 # --------- API Endpoints ---------
 
 @app.get("/", response_model=dict)
@@ -195,15 +681,16 @@ def root():
         "message": "Welcome to C_First Chatbot API",
         "endpoints": {
             "POST /chat": "Send a question to the chatbot",
+            "POST /chat/stream": "Send a question and stream the answer (server-sent events)",
             "GET /docs": "API documentation"
         }
     }
 
 @app.get("/status", response_model=HealthResponse)
-def health_check():
+async def health_check():
     """Health check endpoint"""
     try:
-        db_count = collection.count() if collection else 0
+        db_count = len(index_rows) if index_rows is not None else 0
         return HealthResponse(
             status="working",
             message="API is running smoothly",
@@ -213,7 +700,7 @@ def health_check():
         raise HTTPException(status_code=500, detail=f"failed: {str(e)}")
 
 @app.post("/chat", response_model=QueryResponse)
-def chat(query: QueryRequest):
+async def chat(query: QueryRequest):
     """
     Main chat endpoint - send a question and get an answer
     """
@@ -221,7 +708,7 @@ def chat(query: QueryRequest):
         if not query.question or not query.question.strip():
             raise HTTPException(status_code=400, detail="Question cannot be empty")
         
-        answer, similarity = rag_answer(query.question, query.similarity_threshold)
+        answer, similarity = await rag_answer(query.question, query.similarity_threshold)
         
         return QueryResponse(
             status="success",
@@ -232,6 +719,44 @@ def chat(query: QueryRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
+def sse_event(payload: dict) -> str:
+    """Format a payload as a server-sent event"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(query: QueryRequest):
+    """
+    Streaming chat endpoint - GPT fallback answers are sent token by token as server-sent events
+    """
+    if not query.question or not query.question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+
+    try:
+        answer, similarity, prompt = await prepare_answer(query.question, query.similarity_threshold)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+
+    async def event_gen():
+        similarity_score = round(similarity, 4) if similarity else None
+        if prompt is None:
+            yield sse_event({"content": answer})
+        else:
+            parts = []
+            try:
+                stream = await create_chat_completion(prompt, stream=True)
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield sse_event({"content": delta})
+            except Exception as e:
+                yield sse_event({"error": f"Error processing query: {str(e)}"})
+                return
+            cache_answer(query.question, query.similarity_threshold, "".join(parts), similarity)
+        yield sse_event({"done": True, "similarity_score": similarity_score})
+
+    return StreamingResponse(event_gen(), media_type="text/event-stream")
+
 # @app.get("/database/stats")
 # def get_database_stats():
 #     """Get statistics about the vector database"""
@@ -242,4 +767,26 @@ def chat(query: QueryRequest):
 #             "status": "active"
 #         }
 #     except Exception as e:
-#         raise HTTPException(status_code=500, detail=f"Error fetching stats: {str(e)}")
\ No newline at end of file
+#         raise HTTPException(status_code=500, detail=f"Error fetching stats: {str(e)}")
+
+async def prepare_cache():
+    """Build the index and prototype caches once, before workers start"""
+    openai_client = make_openai_client()
+    try:
+        await load_or_build_index(openai_client)
+        await load_or_build_prototypes(openai_client)
+    finally:
+        await openai_client.close()
+
+if __name__ == "__main__":
+    # Pre-fork launcher: one process builds the cache, then every worker
+    # memory-maps the same files instead of embedding the dataset again
+    import uvicorn
+
+    asyncio.run(prepare_cache())
+    uvicorn.run(
+        "f_app:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "4"))
+    )